@@ -13,4 +13,22 @@ class Config:
     EXTERNAL_API_URL = os.getenv("EXTERNAL_API_URL", "https://mock-api.com/dicom/v2/studies")
     EXTERNAL_API_KEY = os.getenv("EXTERNAL_API_KEY", "")
 
+    # Global cap on concurrent requests to the external API (shared by all endpoints)
+    UPSTREAM_MAX_IN_FLIGHT = int(os.getenv("UPSTREAM_MAX_IN_FLIGHT", 4))
+    # Max requests waiting per background class (batch/prefetch); extra ones are rejected
+    UPSTREAM_MAX_QUEUED = int(os.getenv("UPSTREAM_MAX_QUEUED", 8))
+    # Max interactive requests waiting; kept separate so users are never
+    # rejected because of background work, but still bounded
+    UPSTREAM_MAX_QUEUED_INTERACTIVE = int(os.getenv("UPSTREAM_MAX_QUEUED_INTERACTIVE", 16))
+    # Max seconds any request waits for an upstream slot before giving up
+    UPSTREAM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT_SECONDS", 30))
+
+    # Where study parsing/aggregation runs: "inline", "process" or "auto"
+    # (auto sends responses larger than the threshold to the process pool)
+    ANALYTICS_EXECUTION_MODE = os.getenv("ANALYTICS_EXECUTION_MODE", "auto")
+    ANALYTICS_OFFLOAD_THRESHOLD_BYTES = int(os.getenv("ANALYTICS_OFFLOAD_THRESHOLD_BYTES", 512 * 1024))
+    ANALYTICS_POOL_WORKERS = int(os.getenv("ANALYTICS_POOL_WORKERS", 2))
+    # Max seconds to wait for a pool worker before failing the request
+    ANALYTICS_POOL_TIMEOUT_SECONDS = float(os.getenv("ANALYTICS_POOL_TIMEOUT_SECONDS", 60))
+
 config = Config()
@@ -1,14 +1,24 @@
 from fastapi import FastAPI, HTTPException, Query
-from typing import List
-from app.models import Client, AnalyticsSummary, ClientOverview
+from typing import List, Optional
+from app.models import Client, AnalyticsSummary, ClientOverview, DraftChanges
 from app.services.clickhouse import clickhouse_service
 from app.services.external_api import external_api_service
+from app.services.errors import UpstreamError
 from app.services.analytics import analytics_service
+from app.services.draft_changes import draft_change_service
+from app.services.scheduler import upstream_scheduler, SchedulerBusy, BATCH, PREFETCH
+from contextlib import asynccontextmanager
 from functools import lru_cache
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
 import time
 
-app = FastAPI(title="Production Analytics Dashboard API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Stop the aggregation process pool on shutdown
+    analytics_service.shutdown()
+
+app = FastAPI(title="Production Analytics Dashboard API", lifespan=lifespan)
 
 # Simple in-memory cache for clients (TTL could be added with a more complex cache)
 @lru_cache(maxsize=1)
@@ -34,16 +44,55 @@ def get_analytics(
         raise HTTPException(status_code=400, detail="Start date must be earlier than end date")
 
     try:
-        # Fetch Studies
-        studies = external_api_service.get_studies(client_id, start_date, end_date)
+        # Fetch Studies (raw response, parsed alongside aggregation)
+        payload = external_api_service.fetch_payload(client_id, start_date, end_date)
         
         # Process Analytics
-        summary = analytics_service.process_studies(studies)
+        summary = analytics_service.summarize_payload(payload)
         
         return summary
+    except SchedulerBusy as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch analytics: {str(e)}")
 
+@app.get("/drafts/changes", response_model=DraftChanges)
+def get_draft_changes(
+    client_id: int = Query(..., description="Client ID"),
+    since: Optional[str] = Query(None, description="Token from a previous /drafts/changes response"),
+    start_date: Optional[str] = Query(None, description="Start Date (YYYYMMDD), defaults to today"),
+    end_date: Optional[str] = Query(None, description="End Date (YYYYMMDD), defaults to today")
+):
+    today = date.today().strftime("%Y%m%d")
+    start_date = start_date or today
+    end_date = end_date or today
+
+    # Dates are part of the snapshot key, so reject anything that isn't YYYYMMDD
+    # (strptime alone accepts e.g. "2025011" or "202511")
+    for value in (start_date, end_date):
+        try:
+            valid = len(value) == 8 and value.isdigit() and bool(datetime.strptime(value, "%Y%m%d"))
+        except ValueError:
+            valid = False
+        if not valid:
+            raise HTTPException(status_code=400, detail=f"Invalid date '{value}', expected YYYYMMDD")
+
+    if start_date > end_date:
+        raise HTTPException(status_code=400, detail="Start date must be earlier than end date")
+
+    try:
+        # Polled in the background by the favourites board.
+        # Upstream failures must not be recorded as an empty draft set.
+        payload = external_api_service.request_payload(client_id, start_date, end_date, priority=PREFETCH)
+        return draft_change_service.get_changes_for_payload(client_id, start_date, end_date, payload, since)
+    except SchedulerBusy as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except UpstreamError as e:
+        # Includes InvalidPayloadError from strict parsing
+        raise HTTPException(status_code=502, detail=f"Upstream API error: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch draft changes: {str(e)}")
+
 # Global Cache for Overview
 overview_cache = {
     "data": [],
@@ -76,14 +125,18 @@ def get_overview(refresh: bool = False):
         for client in clients:
             try:
                 # We use the same service but we might want to optimize this
-                studies = external_api_service.get_studies(client.id, start_date, end_date)
-                summary = analytics_service.process_studies(studies)
+                payload = external_api_service.fetch_payload(client.id, start_date, end_date, priority=BATCH)
+                summary = analytics_service.summarize_payload(payload)
                 
                 if summary.draft_cases > 0:
                     overview_data.append(ClientOverview(
                         client_name=client.client_name,
                         draft_cases=summary.draft_cases
                     ))
+            except SchedulerBusy as e:
+                # Upstream is saturated; keep the previous overview rather than caching a partial one
+                print(f"Overview rebuild deferred: {e}")
+                return overview_cache["data"]
             except Exception as e:
                 print(f"Error processing client {client.client_name}: {e}")
                 continue
@@ -100,6 +153,10 @@ def get_overview(refresh: bool = False):
         print(f"Overview error: {e}")
         return []
 
+@app.get("/scheduler/stats")
+def get_scheduler_stats():
+    return upstream_scheduler.get_stats()
+
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
@@ -44,3 +44,16 @@ class AnalyticsSummary(BaseModel):
 class ClientOverview(BaseModel):
     client_name: str
     draft_cases: int
+
+class DraftCase(CaseDetail):
+    study_key: str
+
+class DraftChanges(BaseModel):
+    client_id: int
+    token: str
+    # True when `since` was missing or expired and `added` holds the full draft list
+    full_refresh: bool
+    draft_cases: int
+    added: List[DraftCase] = []
+    removed: List[DraftCase] = []
+    finalized: List[DraftCase] = []
@@ -1,11 +1,167 @@
-from typing import List
+from typing import Callable, Dict, List, Optional, TypeVar
 from app.models import Study, AnalyticsSummary, CaseDetail
+from app.config import config
+from app.services.errors import InvalidPayloadError
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
 from zoneinfo import ZoneInfo
-from app.models import Study, AnalyticsSummary, CaseDetail
+import json
+import multiprocessing
+import threading
+
+T = TypeVar("T")
+
+def parse_studies(payload: bytes, strict: bool = False) -> List[Study]:
+    # strict: raise InvalidPayloadError on a malformed payload or on any item
+    # that fails validation, instead of skipping it
+    try:
+        data = json.loads(payload or b"[]")
+        if not isinstance(data, list):
+            raise ValueError(f"Expected a list of studies, got {type(data).__name__}")
+    except ValueError as e:
+        if strict:
+            raise InvalidPayloadError(str(e))
+        print(f"Invalid studies payload: {e}")
+        return []
+
+    studies = []
+    for item in data:
+        try:
+            study = Study(**item)
+            studies.append(study)
+        except Exception as e:
+            if strict:
+                # First line only, e.g. "12 validation errors for Study"
+                raise InvalidPayloadError(f"Invalid study at index {len(studies)}: {str(e).splitlines()[0]}")
+            # print(f"Error parsing study: {e}")
+            continue
+    return studies
+
+def _summarize_in_worker(payload: bytes) -> dict:
+    # Runs in the process pool: takes the raw API response bytes and returns
+    # plain dicts/lists so nothing pydantic is pickled on the way back
+    return AnalyticsService().aggregate(parse_studies(payload))
 
 class AnalyticsService:
+    def __init__(self):
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+
+    def format_created_time(self, created_time: Optional[str]) -> Optional[str]:
+        # Format Created Time (IST 12hr)
+        formatted_time = created_time
+        try:
+            if created_time:
+                # Parse ISO format (e.g., 2025-12-24T16:27:46.599Z)
+                dt = datetime.fromisoformat(created_time.replace('Z', '+00:00'))
+                # Convert to IST
+                ist = ZoneInfo("Asia/Kolkata")
+                dt_ist = dt.astimezone(ist)
+                # Format: DD-MM-YYYY HH:MM AM/PM
+                formatted_time = dt_ist.strftime("%d-%m-%Y %I:%M %p")
+        except Exception as e:
+            # Fallback if parsing fails
+            print(f"Date parsing error: {e}")
+            formatted_time = created_time
+        return formatted_time
+
+    def case_fields(self, study: Study) -> dict:
+        return {
+            "patient_name": study.patient_name,
+            "patient_id": study.patient_id,
+            "created_time": self.format_created_time(study.created_time),
+            "series_count": study.series_count,
+            "instance_count": study.instance_count,
+            "modality": study.modalities,
+            "study_description": study.study_desc
+        }
+
     def process_studies(self, studies: List[Study]) -> AnalyticsSummary:
+        return self._build_summary(self.aggregate(studies))
+
+    def summarize_payload(self, payload: bytes) -> AnalyticsSummary:
+        # Parse + aggregate a raw API response, in the process pool if it is large
+        return self._build_summary(self.run_payload(_summarize_in_worker, payload))
+
+    def run_payload(self, fn: Callable[[bytes], T], payload: bytes) -> T:
+        # Runs fn(payload) inline, or in the process pool when the payload is
+        # large enough that parsing it would hold the GIL in the server worker.
+        # fn must be a module-level function returning plain dicts/lists.
+        if not self._should_offload(payload):
+            return fn(payload)
+
+        # A crashed worker is retried once on a fresh pool but never inline:
+        # a payload that killed a worker (e.g. out of memory) could take the
+        # API server down with it.
+        for attempt in (1, 2):
+            pool = self._get_pool()
+            try:
+                future = pool.submit(fn, payload)
+                return future.result(timeout=config.ANALYTICS_POOL_TIMEOUT_SECONDS)
+            except BrokenProcessPool as e:
+                # Errors raised by fn itself are deterministic and propagate as-is
+                print(f"Process pool worker died (attempt {attempt}): {e}")
+                self._reset_pool(pool)
+                if attempt == 2:
+                    raise
+            except FutureTimeoutError:
+                # cancel() can't stop a running task; replace the pool so the
+                # stuck worker doesn't hold a slot for later requests
+                print(f"Process pool task exceeded {config.ANALYTICS_POOL_TIMEOUT_SECONDS}s, replacing pool")
+                self._reset_pool(pool, terminate=True)
+                raise TimeoutError(f"Aggregation did not finish within {config.ANALYTICS_POOL_TIMEOUT_SECONDS}s")
+
+    def _build_summary(self, result: dict) -> AnalyticsSummary:
+        # The fields come from validated Study objects, so skip re-validating
+        # every case here; FastAPI still checks the response model.
+        return AnalyticsSummary.model_construct(
+            total_cases=result["total_cases"],
+            draft_cases=result["draft_cases"],
+            modality_distribution=result["modality_distribution"],
+            cases=[CaseDetail.model_construct(**case) for case in result["cases"]]
+        )
+
+    def _should_offload(self, payload: bytes) -> bool:
+        mode = config.ANALYTICS_EXECUTION_MODE
+        if mode == "process":
+            return True
+        if mode == "auto":
+            return len(payload) >= config.ANALYTICS_OFFLOAD_THRESHOLD_BYTES
+        return False
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                # spawn: forking a process that is running threadpool handlers is unsafe
+                self._pool = ProcessPoolExecutor(
+                    max_workers=config.ANALYTICS_POOL_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._pool
+
+    def _reset_pool(self, broken: ProcessPoolExecutor, terminate: bool = False):
+        # A crashed or stuck worker makes the executor unusable; drop it so the
+        # next large request starts a fresh one. Only drop it if no other
+        # request has already replaced it.
+        with self._pool_lock:
+            if self._pool is not broken:
+                return
+            self._pool = None
+        if terminate:
+            # shutdown() waits for running tasks, so stop stuck workers first.
+            # ProcessPoolExecutor has no public API for this before 3.14.
+            for process in list((getattr(broken, "_processes", None) or {}).values()):
+                process.terminate()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    def aggregate(self, studies: List[Study]) -> dict:
         total_cases = len(studies)
         draft_cases = 0
         finalized_cases = 0
@@ -19,33 +175,9 @@ class AnalyticsService:
             # ecomm_status == null -> Draft
             if study.ecomm_status is not True:
                 draft_cases += 1
-                
-                # Format Created Time (IST 12hr)
-                formatted_time = study.created_time
-                try:
-                    if study.created_time:
-                        # Parse ISO format (e.g., 2025-12-24T16:27:46.599Z)
-                        dt = datetime.fromisoformat(study.created_time.replace('Z', '+00:00'))
-                        # Convert to IST
-                        ist = ZoneInfo("Asia/Kolkata")
-                        dt_ist = dt.astimezone(ist)
-                        # Format: DD-MM-YYYY HH:MM AM/PM
-                        formatted_time = dt_ist.strftime("%d-%m-%Y %I:%M %p")
-                except Exception as e:
-                    # Fallback if parsing fails
-                    print(f"Date parsing error: {e}")
-                    formatted_time = study.created_time
 
                 # Collect detailed info
-                detailed_cases.append(CaseDetail(
-                    patient_name=study.patient_name,
-                    patient_id=study.patient_id,
-                    created_time=formatted_time,
-                    series_count=study.series_count,
-                    instance_count=study.instance_count,
-                    modality=study.modalities,
-                    study_description=study.study_desc
-                ))
+                detailed_cases.append(self.case_fields(study))
 
             # Modality Handling
             # Split by comma, trim, uppercase
@@ -71,11 +203,11 @@ class AnalyticsService:
                     
                 modality_counts[key] = modality_counts.get(key, 0) + 1
 
-        return AnalyticsSummary(
-            total_cases=total_cases,
-            draft_cases=draft_cases,
-            modality_distribution=modality_counts,
-            cases=detailed_cases
-        )
+        return {
+            "total_cases": total_cases,
+            "draft_cases": draft_cases,
+            "modality_distribution": modality_counts,
+            "cases": detailed_cases
+        }
 
 analytics_service = AnalyticsService()
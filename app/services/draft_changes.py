@@ -0,0 +1,132 @@
+from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
+from app.models import Study, DraftCase, DraftChanges
+from app.services.analytics import analytics_service, parse_studies
+import itertools
+import threading
+import uuid
+
+# Number of snapshots kept per client/date range. Tokens older than this are
+# treated as expired and the caller gets a full refresh.
+MAX_SNAPSHOTS_PER_SCOPE = 20
+# Number of client/date-range scopes kept; least recently polled are dropped first
+MAX_SCOPES = 500
+
+def study_key(study: Study) -> str:
+    # The upstream payload has no study UID. Accession number identifies a
+    # study within a client; otherwise fall back to every identifying field
+    # we have. Two studies can still share a fallback key (same patient,
+    # time, description and modality); collect_drafts numbers those so they
+    # are counted separately, though which one is "#2" follows upstream order.
+    if study.accession_no and study.accession_no.strip():
+        return f"acc:{study.accession_no.strip()}"
+    return "pt:" + "|".join([
+        study.patient_id or "",
+        study.study_date,
+        study.study_time,
+        study.created_time or "",
+        study.study_desc or "",
+        study.modalities or ""
+    ])
+
+def collect_drafts(studies: List[Study]) -> dict:
+    drafts = []
+    finalized = []
+    seen: Dict[str, int] = {}
+    for study in studies:
+        key = study_key(study)
+        # Keep duplicate keys apart so draft counts match /analytics
+        seen[key] = seen.get(key, 0) + 1
+        if seen[key] > 1:
+            key = f"{key}#{seen[key]}"
+        # Same classification as AnalyticsService.aggregate
+        if study.ecomm_status is not True:
+            drafts.append({"study_key": key, **analytics_service.case_fields(study)})
+        else:
+            finalized.append(key)
+    return {"drafts": drafts, "finalized": finalized}
+
+def _collect_drafts_in_worker(payload: bytes) -> dict:
+    # Process pool entry point; strict so a bad upstream body is an error,
+    # never an empty draft set
+    return collect_drafts(parse_studies(payload, strict=True))
+
+class DraftChangeService:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Tokens are prefixed with a per-process id so a token issued before a
+        # restart, or by another worker, never matches a snapshot here
+        self._boot_id = uuid.uuid4().hex[:12]
+        self._versions = itertools.count(1)
+        # (client_id, start_date, end_date) -> OrderedDict[token -> {study_key: DraftCase}]
+        self._snapshots: "OrderedDict[Tuple[int, str, str], OrderedDict[str, Dict[str, DraftCase]]]" = OrderedDict()
+
+    def get_changes(self, client_id: int, start_date: str, end_date: str,
+                    studies: List[Study], since: Optional[str] = None) -> DraftChanges:
+        return self._diff(client_id, start_date, end_date, collect_drafts(studies), since)
+
+    def get_changes_for_payload(self, client_id: int, start_date: str, end_date: str,
+                                payload: bytes, since: Optional[str] = None) -> DraftChanges:
+        # Large payloads are parsed in the analytics process pool
+        collected = analytics_service.run_payload(_collect_drafts_in_worker, payload)
+        return self._diff(client_id, start_date, end_date, collected, since)
+
+    def _diff(self, client_id: int, start_date: str, end_date: str,
+              collected: dict, since: Optional[str]) -> DraftChanges:
+        # Fields come from validated Study objects, no need to validate again
+        current: Dict[str, DraftCase] = {
+            case["study_key"]: DraftCase.model_construct(**case) for case in collected["drafts"]
+        }
+        finalized_keys = set(collected["finalized"])
+
+        scope = (client_id, start_date, end_date)
+
+        with self._lock:
+            history = self._snapshots.get(scope)
+            if history is None:
+                history = self._snapshots[scope] = OrderedDict()
+                while len(self._snapshots) > MAX_SCOPES:
+                    self._snapshots.popitem(last=False)
+            else:
+                self._snapshots.move_to_end(scope)
+            previous = history.get(since) if since else None
+
+            # Only record a new snapshot when the draft set actually changed
+            token = next(reversed(history), None) if history else None
+            if token is None or history[token].keys() != current.keys():
+                token = f"{self._boot_id}-{next(self._versions)}"
+                history[token] = current
+                while len(history) > MAX_SNAPSHOTS_PER_SCOPE:
+                    history.popitem(last=False)
+
+        if previous is None:
+            return DraftChanges(
+                client_id=client_id,
+                token=token,
+                full_refresh=True,
+                draft_cases=len(current),
+                added=list(current.values())
+            )
+
+        added = [case for key, case in current.items() if key not in previous]
+        removed = []
+        finalized = []
+        for key, case in previous.items():
+            if key in current:
+                continue
+            if key in finalized_keys:
+                finalized.append(case)
+            else:
+                removed.append(case)
+
+        return DraftChanges(
+            client_id=client_id,
+            token=token,
+            full_refresh=False,
+            draft_cases=len(current),
+            added=added,
+            removed=removed,
+            finalized=finalized
+        )
+
+draft_change_service = DraftChangeService()
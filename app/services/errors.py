@@ -0,0 +1,6 @@
+class UpstreamError(Exception):
+    pass
+
+# The upstream answered 200 but the body is not a valid list of studies
+class InvalidPayloadError(UpstreamError):
+    pass
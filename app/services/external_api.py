@@ -1,57 +1,67 @@
 from typing import List, Optional
 from app.models import Study
 from app.config import config
+from app.services.scheduler import upstream_scheduler, SchedulerBusy, INTERACTIVE
+from app.services.analytics import parse_studies
+from app.services.errors import UpstreamError
 import requests
 import time
 
 class ExternalApiService:
-    def get_studies(self, client_id: int, start_date: str, end_date: str) -> List[Study]:
+    def get_studies(self, client_id: int, start_date: str, end_date: str, priority: str = INTERACTIVE) -> List[Study]:
+        return parse_studies(self.fetch_payload(client_id, start_date, end_date, priority))
+
+    def fetch_payload(self, client_id: int, start_date: str, end_date: str, priority: str = INTERACTIVE) -> bytes:
+        # Returns the raw JSON response body so callers can decide where to parse it.
+        # Upstream failures are logged and treated as an empty study list;
+        # SchedulerBusy is re-raised so callers can shed load instead.
+        try:
+            return self.request_payload(client_id, start_date, end_date, priority)
+        except SchedulerBusy:
+            raise
+        except Exception as e:
+            print(f"External API Request Failed: {e}")
+            return b"[]"
+
+    def request_payload(self, client_id: int, start_date: str, end_date: str, priority: str = INTERACTIVE) -> bytes:
+        # Like fetch_payload, but raises UpstreamError instead of returning an
+        # empty list, for callers that must not mistake a failure for "no studies"
         # Format dates as YYYY-MM-DD for the API if needed, or keep as is.
         # User example: start_date=2025-12-18
         # Input start_date is YYYYMMDD from app/main.py
+        formatted_start = f"{start_date[:4]}-{start_date[4:6]}-{start_date[6:]}"
+        formatted_end = f"{end_date[:4]}-{end_date[4:6]}-{end_date[6:]}"
         
-        try:
-            formatted_start = f"{start_date[:4]}-{start_date[4:6]}-{start_date[6:]}"
-            formatted_end = f"{end_date[:4]}-{end_date[4:6]}-{end_date[6:]}"
-            
-            url = "https://api.5cnetwork.com/dicom/v2/studies"
-            params = {
-                "start_date": formatted_start,
-                "end_date": formatted_end,
-                "clientId": client_id
-            }
-            
-            # Authorization Header
-            # User provided: NWNuZXR3b3JrOjVjbmV0d29yaw== (Decodes to 5cnetwork:5cnetwork)
-            headers = {
-                "Authorization": "NWNuZXR3b3JrOjVjbmV0d29yaw=="
-            }
-
-            print(f"DEBUG: Requesting {url}")
-            print(f"DEBUG: Params: {params}")
-            print(f"DEBUG: Headers: {headers}")
+        url = "https://api.5cnetwork.com/dicom/v2/studies"
+        params = {
+            "start_date": formatted_start,
+            "end_date": formatted_end,
+            "clientId": client_id
+        }
+        
+        # Authorization Header
+        # User provided: NWNuZXR3b3JrOjVjbmV0d29yaw== (Decodes to 5cnetwork:5cnetwork)
+        headers = {
+            "Authorization": "NWNuZXR3b3JrOjVjbmV0d29yaw=="
+        }
 
+        print(f"DEBUG: Requesting {url}")
+        print(f"DEBUG: Params: {params}")
+        print(f"DEBUG: Headers: {headers}")
+
+        try:
             # Screenshot shows POST method
-            response = requests.post(url, params=params, headers=headers, timeout=10)
-            
-            if response.status_code == 200:
-                data = response.json()
-                studies = []
-                for item in data:
-                    try:
-                        study = Study(**item)
-                        studies.append(study)
-                    except Exception as e:
-                        # print(f"Error parsing study: {e}")
-                        continue
-                return studies
-            else:
-                print(f"API Error: {response.status_code} - {response.text}")
-                return []
-                
-        except Exception as e:
-            print(f"External API Request Failed: {e}")
-            return []
+            # Wait for an upstream slot; background work yields to interactive calls
+            with upstream_scheduler.slot(priority, client_id):
+                response = requests.post(url, params=params, headers=headers, timeout=10)
+        except requests.RequestException as e:
+            raise UpstreamError(f"Request failed: {e}")
+
+        if response.status_code != 200:
+            print(f"API Error: {response.status_code} - {response.text}")
+            raise UpstreamError(f"API returned {response.status_code}")
+
+        return response.content
 
 external_api_service = ExternalApiService()
 
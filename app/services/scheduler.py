@@ -0,0 +1,149 @@
+from typing import Dict, Optional
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from app.config import config
+import threading
+import time
+
+# Priority classes, highest first
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PREFETCH = "prefetch"
+PRIORITIES = (INTERACTIVE, BATCH, PREFETCH)
+
+class SchedulerBusy(Exception):
+    pass
+
+class _Ticket:
+    __slots__ = ("granted",)
+
+    def __init__(self):
+        self.granted = False
+
+# Caps in-flight upstream requests and hands out slots by priority class.
+# Within a class, waiting requests are served round-robin per client so one
+# client's bulk work cannot starve another client's requests.
+# Every waiter holds a server thread, so each class has a bounded queue
+# (interactive gets its own, larger bound) and all waits time out; both
+# raise SchedulerBusy.
+class UpstreamScheduler:
+    def __init__(self, max_in_flight: int, max_queued: int, queue_timeout: float,
+                 max_queued_interactive: Optional[int] = None):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queued = max(0, max_queued)
+        self.max_queued_interactive = max(0, max_queued if max_queued_interactive is None else max_queued_interactive)
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        # priority -> OrderedDict[client_id -> deque[_Ticket]]
+        self._queues: Dict[str, "OrderedDict[Optional[int], deque]"] = {p: OrderedDict() for p in PRIORITIES}
+        self._stats = {
+            p: {"requests": 0, "total_wait": 0.0, "max_wait": 0.0, "rejected": 0, "timed_out": 0}
+            for p in PRIORITIES
+        }
+
+    def _dispatch(self):
+        # Caller must hold self._cond
+        granted = False
+        while self._in_flight < self.max_in_flight:
+            ticket = None
+            for priority in PRIORITIES:
+                clients = self._queues[priority]
+                if not clients:
+                    continue
+                client_id, waiting = next(iter(clients.items()))
+                ticket = waiting.popleft()
+                # Rotate the client to the back so the next slot goes to someone else
+                if waiting:
+                    clients.move_to_end(client_id)
+                else:
+                    del clients[client_id]
+                break
+
+            if ticket is None:
+                break
+            ticket.granted = True
+            self._in_flight += 1
+            granted = True
+
+        if granted:
+            self._cond.notify_all()
+
+    def _remove(self, priority: str, client_id: Optional[int], ticket: _Ticket):
+        # Caller must hold self._cond
+        clients = self._queues[priority]
+        waiting = clients.get(client_id)
+        if waiting is None:
+            return
+        waiting.remove(ticket)
+        if not waiting:
+            del clients[client_id]
+
+    @contextmanager
+    def slot(self, priority: str = INTERACTIVE, client_id: Optional[int] = None):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+
+        ticket = _Ticket()
+        enqueued_at = time.monotonic()
+        deadline = enqueued_at + self.queue_timeout
+
+        with self._cond:
+            queue = self._queues[priority]
+            limit = self.max_queued_interactive if priority == INTERACTIVE else self.max_queued
+            if (self._in_flight >= self.max_in_flight and
+                    sum(len(q) for q in queue.values()) >= limit):
+                self._stats[priority]["rejected"] += 1
+                raise SchedulerBusy(f"Upstream queue full for {priority} requests")
+
+            queue.setdefault(client_id, deque()).append(ticket)
+            self._dispatch()
+            while not ticket.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._remove(priority, client_id, ticket)
+                    self._stats[priority]["timed_out"] += 1
+                    raise SchedulerBusy(f"Timed out waiting for an upstream slot ({priority})")
+                self._cond.wait(remaining)
+
+            waited = time.monotonic() - enqueued_at
+            stats = self._stats[priority]
+            stats["requests"] += 1
+            stats["total_wait"] += waited
+            stats["max_wait"] = max(stats["max_wait"], waited)
+
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._dispatch()
+
+    def get_stats(self) -> dict:
+        with self._cond:
+            classes = {}
+            for priority in PRIORITIES:
+                stats = self._stats[priority]
+                requests = stats["requests"]
+                classes[priority] = {
+                    "queue_depth": sum(len(q) for q in self._queues[priority].values()),
+                    "requests": requests,
+                    "avg_wait_ms": round(stats["total_wait"] / requests * 1000, 2) if requests else 0.0,
+                    "max_wait_ms": round(stats["max_wait"] * 1000, 2),
+                    "rejected": stats["rejected"],
+                    "timed_out": stats["timed_out"]
+                }
+            return {
+                "max_in_flight": self.max_in_flight,
+                "max_queued": self.max_queued,
+                "max_queued_interactive": self.max_queued_interactive,
+                "in_flight": self._in_flight,
+                "classes": classes
+            }
+
+upstream_scheduler = UpstreamScheduler(
+    config.UPSTREAM_MAX_IN_FLIGHT,
+    config.UPSTREAM_MAX_QUEUED,
+    config.UPSTREAM_QUEUE_TIMEOUT_SECONDS,
+    config.UPSTREAM_MAX_QUEUED_INTERACTIVE
+)
@@ -44,6 +44,18 @@ def fetch_analytics(client_id, start_date, end_date):
     except:
         return None
 
+def fetch_draft_changes(client_id, since=None):
+    try:
+        params = {"client_id": client_id}
+        if since:
+            params["since"] = since
+        response = requests.get(f"{API_URL}/drafts/changes", params=params)
+        if response.status_code == 200:
+            return response.json()
+        return None
+    except:
+        return None
+
 def fetch_overview(refresh=False):
     try:
         params = {"refresh": "true"} if refresh else {}
@@ -242,6 +254,10 @@ if not selected_client_name:
     # Initialize dashboard_counts if not present
     if 'dashboard_counts' not in st.session_state:
         st.session_state.dashboard_counts = {}
+    if 'draft_tokens' not in st.session_state:
+        st.session_state.draft_tokens = {}
+    if 'draft_keys' not in st.session_state:
+        st.session_state.draft_keys = {}
 
     # Auto-fetch counts for Favourite Clients
     if 'pinned_clients' in st.session_state and st.session_state.pinned_clients:
@@ -250,7 +266,6 @@ if not selected_client_name:
         # To avoid infinite rerun loops, we can check a flag or just do it once per render
         
         clients_to_fetch = st.session_state.pinned_clients
-        today = date.today()
         
         # We use a placeholder to show loading status without blocking the whole UI if possible,
         # but for simplicity and correctness, we'll iterate and fetch.
@@ -271,9 +286,17 @@ if not selected_client_name:
             try:
                 c_id = client_options.get(client_name)
                 if c_id:
-                    c_data = fetch_analytics(c_id, today, today)
-                    if c_data:
-                        st.session_state.dashboard_counts[client_name] = c_data['draft_cases']
+                    # Only the delta since the last token is transferred
+                    since = st.session_state.draft_tokens.get(client_name)
+                    changes = fetch_draft_changes(c_id, since)
+                    if changes:
+                        # Apply the delta to the draft set we already hold for this client
+                        keys = set() if changes['full_refresh'] else set(st.session_state.draft_keys.get(client_name, set()))
+                        keys |= {c['study_key'] for c in changes['added']}
+                        keys -= {c['study_key'] for c in changes['removed'] + changes['finalized']}
+                        st.session_state.draft_keys[client_name] = keys
+                        st.session_state.draft_tokens[client_name] = changes['token']
+                        st.session_state.dashboard_counts[client_name] = len(keys)
                     else:
                         st.session_state.dashboard_counts[client_name] = "Err"
             except Exception:
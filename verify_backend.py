@@ -2,6 +2,177 @@ import requests
 import time
 import subprocess
 import sys
+import threading
+
+def make_study(accession_no, ecomm_status):
+    from app.models import Study
+    return Study(
+        study_date="20250101", study_time="101500", created_time="2025-01-01T10:15:00Z",
+        modalities="CT", ecomm_status=ecomm_status, patient_name="Test", patient_id="P1",
+        study_desc="Head", accession_no=accession_no, client_name="Test Client",
+        series_count=1, instance_count=10
+    )
+
+def test_draft_changes_diff():
+    from app.services.draft_changes import DraftChangeService
+    from app.services.errors import InvalidPayloadError
+    print("Testing draft change snapshots...")
+    service = DraftChangeService()
+
+    first = service.get_changes(1, "20250101", "20250101", [make_study("A", None), make_study("B", False)])
+    assert first.full_refresh and len(first.added) == 2
+
+    # A finalized, B disappeared, C is new
+    second = service.get_changes(1, "20250101", "20250101", [make_study("A", True), make_study("C", None)], since=first.token)
+    assert not second.full_refresh
+    assert [c.study_key for c in second.added] == ["acc:C"]
+    assert [c.study_key for c in second.removed] == ["acc:B"]
+    assert [c.study_key for c in second.finalized] == ["acc:A"]
+
+    # Unchanged set keeps the same token and returns an empty delta
+    third = service.get_changes(1, "20250101", "20250101", [make_study("C", None)], since=second.token)
+    assert third.token == second.token and not (third.added or third.removed or third.finalized)
+
+    # Tokens from another process (e.g. before a restart) force a full refresh
+    other = DraftChangeService().get_changes(1, "20250101", "20250101", [make_study("C", None)])
+    assert service.get_changes(1, "20250101", "20250101", [make_study("C", None)], since=other.token).full_refresh
+    # Items failing validation are an upstream error, not an empty draft set;
+    # the stored snapshot is left alone
+    try:
+        service.get_changes_for_payload(1, "20250101", "20250101", b'[{"bad": 1}]', since=second.token)
+        assert False, "invalid study should raise"
+    except InvalidPayloadError:
+        pass
+    after = service.get_changes(1, "20250101", "20250101", [make_study("C", None)], since=second.token)
+    assert after.token == second.token and not (after.added or after.removed or after.finalized)
+
+    # Studies without accession numbers that share every other field are still counted separately
+    twins = service.get_changes(2, "20250101", "20250101", [make_study(None, None), make_study(None, None)])
+    assert twins.draft_cases == 2 and len({c.study_key for c in twins.added}) == 2
+    print("Draft change snapshots passed.")
+
+def test_scheduler_order():
+    from app.services.scheduler import UpstreamScheduler, SchedulerBusy
+    print("Testing upstream scheduler...")
+    scheduler = UpstreamScheduler(max_in_flight=1, max_queued=2, queue_timeout=5)
+    order = []
+
+    def run(priority, client_id, name):
+        try:
+            with scheduler.slot(priority, client_id):
+                order.append(name)
+                time.sleep(0.3 if name == "hold" else 0.02)
+        except SchedulerBusy:
+            order.append(f"rejected:{name}")
+
+    # Hold the only slot, then queue work across classes and clients
+    threads = [threading.Thread(target=run, args=("prefetch", 1, "hold"))]
+    threads[0].start()
+    time.sleep(0.01)
+    for args in [("prefetch", 1, "p1"), ("batch", 1, "b1a"), ("batch", 1, "b1b"),
+                 ("batch", 2, "b2"), ("interactive", 3, "i")]:
+        thread = threading.Thread(target=run, args=args)
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join()
+
+    # Interactive first, batch round-robin per client, prefetch last;
+    # the third queued batch request is rejected by the queue bound
+    assert order == ["hold", "rejected:b2", "i", "b1a", "b1b", "p1"], order
+    assert scheduler.get_stats()["classes"]["batch"]["rejected"] == 1
+
+    # Waits time out instead of holding the thread forever
+    scheduler = UpstreamScheduler(max_in_flight=1, max_queued=2, queue_timeout=0.05)
+    with scheduler.slot("batch", 1):
+        try:
+            with scheduler.slot("interactive", 2):
+                assert False, "slot should have timed out"
+        except SchedulerBusy:
+            pass
+    stats = scheduler.get_stats()
+    assert stats["classes"]["interactive"]["timed_out"] == 1
+    assert stats["classes"]["interactive"]["queue_depth"] == 0
+    # Interactive waiters are bounded too, so a burst cannot use up the threadpool
+    scheduler = UpstreamScheduler(max_in_flight=1, max_queued=2, queue_timeout=1, max_queued_interactive=1)
+    with scheduler.slot("batch", 1):
+        waiter = threading.Thread(target=run, args=("interactive", 2, "queued"))
+        waiter.start()
+        time.sleep(0.05)
+        try:
+            with scheduler.slot("interactive", 3):
+                assert False, "interactive queue should be full"
+        except SchedulerBusy:
+            pass
+    waiter.join()
+    assert scheduler.get_stats()["classes"]["interactive"]["rejected"] == 1
+    print("Upstream scheduler passed.")
+
+def _crash_worker(payload):
+    import os
+    os._exit(1)
+
+def _hang_worker(payload):
+    time.sleep(30)
+
+def test_process_pool_offload():
+    import json
+    from app.config import config
+    from app.services.analytics import analytics_service
+    from app.services.draft_changes import DraftChangeService
+    from app.services.errors import InvalidPayloadError
+    from concurrent.futures.process import BrokenProcessPool
+    print("Testing process pool offload...")
+    items = [make_study(str(i), [True, False, None][i % 3]).model_dump() for i in range(2000)]
+    payload = json.dumps(items).encode()
+
+    mode = config.ANALYTICS_EXECUTION_MODE
+    try:
+        config.ANALYTICS_EXECUTION_MODE = "inline"
+        inline_summary = analytics_service.summarize_payload(payload)
+        inline_changes = DraftChangeService().get_changes_for_payload(1, "20250101", "20250101", payload)
+
+        config.ANALYTICS_EXECUTION_MODE = "process"
+        pooled_summary = analytics_service.summarize_payload(payload)
+        pooled_changes = DraftChangeService().get_changes_for_payload(1, "20250101", "20250101", payload)
+        assert analytics_service._pool is not None
+
+        assert pooled_summary.model_dump() == inline_summary.model_dump()
+        assert [c.model_dump() for c in pooled_changes.added] == [c.model_dump() for c in inline_changes.added]
+
+        # Malformed bodies fail in the worker and are not retried inline
+        try:
+            DraftChangeService().get_changes_for_payload(1, "20250101", "20250101", b"not json")
+            assert False, "malformed payload should raise"
+        except InvalidPayloadError:
+            pass
+
+        # A crashing worker is retried on a fresh pool, then fails; never inline
+        try:
+            analytics_service.run_payload(_crash_worker, payload)
+            assert False, "crashing worker should raise"
+        except BrokenProcessPool:
+            pass
+
+        # A stuck worker times out and its pool is replaced
+        timeout = config.ANALYTICS_POOL_TIMEOUT_SECONDS
+        config.ANALYTICS_POOL_TIMEOUT_SECONDS = 1
+        stuck_pool = analytics_service._get_pool()
+        try:
+            analytics_service.run_payload(_hang_worker, payload)
+            assert False, "stuck worker should time out"
+        except TimeoutError:
+            pass
+        finally:
+            config.ANALYTICS_POOL_TIMEOUT_SECONDS = timeout
+        assert analytics_service._pool is None
+        assert analytics_service._get_pool() is not stuck_pool
+        assert analytics_service.summarize_payload(payload).model_dump() == inline_summary.model_dump()
+    finally:
+        config.ANALYTICS_EXECUTION_MODE = mode
+        analytics_service.shutdown()
+    print("Process pool offload passed.")
 
 def test_backend():
     print("Starting backend for testing...")
@@ -44,6 +215,32 @@ def test_backend():
         else:
             print(f"Failed to fetch analytics: {resp.text}")
 
+        # Test Draft Changes
+        print("Testing /drafts/changes...")
+        for bad_date in ("2025-01-01", "2025011", "202511"):
+            resp = requests.get("http://localhost:8001/drafts/changes", params={"client_id": 123, "start_date": bad_date})
+            assert resp.status_code == 400, bad_date
+        resp = requests.get("http://localhost:8001/drafts/changes", params={"client_id": 123})
+        if resp.status_code == 200:
+            data = resp.json()
+            assert data["full_refresh"] and data["token"]
+            resp = requests.get("http://localhost:8001/drafts/changes", params={"client_id": 123, "since": data["token"]})
+            assert resp.status_code == 200 and not resp.json()["full_refresh"]
+            print("Draft changes passed.")
+        else:
+            # Upstream failures surface as errors instead of an empty draft set
+            assert resp.status_code == 502
+            print(f"Draft changes unavailable upstream: {resp.text}")
+
+        # Test Scheduler Stats
+        print("Testing /scheduler/stats...")
+        resp = requests.get("http://localhost:8001/scheduler/stats")
+        assert resp.status_code == 200
+        stats = resp.json()
+        assert set(stats["classes"]) == {"interactive", "batch", "prefetch"}
+        assert "rejected" in stats["classes"]["batch"]
+        print("Scheduler stats passed.")
+
     except Exception as e:
         print(f"Test failed: {e}")
         if proc.poll() is not None:
@@ -55,4 +252,7 @@ def test_backend():
         proc.terminate()
 
 if __name__ == "__main__":
+    test_draft_changes_diff()
+    test_scheduler_order()
+    test_process_pool_offload()
     test_backend()